@@ -1,49 +1,145 @@
 import os
+import re
+import numpy as np
 import pandas as pd
 import streamlit as st
-import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from io import BytesIO
 import time  # For measuring operation duration
 
+try:  # numba is optional; without it the searchsorted path is used
+    from numba import njit, prange
+    _HAVE_NUMBA = True
+except ImportError:
+    _HAVE_NUMBA = False
+
+# Below this many stocklot rows the JIT compile/dispatch overhead is not
+# worth it and the pandas paths win.
+_NUMBA_MIN_ROWS = 100_000
+
 # Initialize Streamlit app
 st.set_page_config(page_title="ROXAF - Client Stocklot Matching", layout="wide")
 
-# Global variables
-df_stocklot = None
-df_client_needs = None
-
 # Helper functions
+@st.cache_data(show_spinner=False)
+def read_table(file_name, file_bytes):
+    """Parse an uploaded table into a DataFrame, cached per upload.
+
+    Dispatches on the file suffix: Parquet and Feather are read through
+    pyarrow (orders of magnitude faster than xlsx), anything else falls
+    back to pd.read_excel.
+    """
+    suffix = os.path.splitext(file_name)[1].lower()
+    buffer = BytesIO(file_bytes)
+    if suffix == ".parquet":
+        return pd.read_parquet(buffer, engine="pyarrow", dtype_backend="pyarrow")
+    if suffix == ".feather":
+        return pd.read_feather(buffer, dtype_backend="pyarrow")
+    # Arrow-backed dtypes keep strings out of Python objects, which cuts
+    # memory and speeds up groupby/equality on the text columns.
+    return pd.read_excel(buffer).convert_dtypes(dtype_backend="pyarrow")
+
+@st.cache_data(show_spinner=False)
+def prepare_table(df, schema, cache_priority=False):
+    """Normalize an uploaded table once, so the hot paths never re-clean it.
+
+    Casting client / item family / priority to Categorical makes the
+    groupbys and equality checks compare integer codes instead of
+    strings; grammage and laize are coerced to numeric up front. Pass
+    cache_priority=True for the client-needs table to also precompute
+    the lowercased priority column used by classify_needs_by_priority.
+    """
+    for col in (schema.client, schema.item_family, schema.priority):
+        if col and col in df.columns:
+            df[col] = df[col].astype("category")
+
+    # Coerce the measurement columns once here so the per-client paths
+    # never pay for pd.to_numeric + dropna again.
+    measure_cols = [col for col in (schema.grammage, schema.laize) if col and col in df.columns]
+    for col in measure_cols:
+        # Well-formed files already carry numeric dtypes here; coercing
+        # cell-by-cell is only worth it for mixed object columns.
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    if measure_cols:
+        df = df.dropna(subset=measure_cols)
+
+    # Lowercase the priority labels once; classify_needs_by_priority then
+    # matches against this column without re-lowering per call, and the
+    # categorical dtype means the string ops run per category, not per row.
+    # Needs-table only: the stocklot is projected into the exports, where
+    # a helper column must never appear.
+    if cache_priority and schema.priority and schema.priority in df.columns:
+        df["_prio_lc"] = df[schema.priority].astype(str).str.lower().astype("category")
+    return df
+
+@lru_cache(maxsize=None)
 def find_matching_column(df_columns, keywords):
-    """Find a column in the DataFrame that matches any of the given keywords."""
-    for col in df_columns:
-        for keyword in keywords:
-            if keyword.lower() in col.lower():
-                return col
-    return None
-
-def group_client_needs_by_item_family(df_client_needs, client_name):
-    """Group client needs by item family."""
+    """Find a column that matches any of the given keywords.
+
+    Takes tuples so each (columns, keywords) pair is memoized; the
+    keywords compile into one case-insensitive regex and every column
+    is scanned a single time.
+    """
+    search = re.compile("|".join(map(re.escape, keywords)), re.I).search
+    return next((col for col in df_columns if search(col)), None)
+
+@dataclass(frozen=True)
+class Schema:
+    """Column names resolved once per upload, so the hot loops never rescan."""
+    client: str = None
+    item_family: str = None
+    grammage: str = None
+    laize: str = None
+    priority: str = None
+
+def build_schema(df_columns):
+    """Resolve the well-known columns of an uploaded table in one pass."""
+    df_columns = tuple(df_columns)
+    return Schema(
+        client=find_matching_column(df_columns, ("client", "customer", "name")),
+        item_family=find_matching_column(df_columns, ("item family", "family", "item")),
+        grammage=find_matching_column(df_columns, ("grammage", "weight", "gsm")),
+        laize=find_matching_column(df_columns, ("laize", "width", "size")),
+        priority=find_matching_column(df_columns, ("priority", "urgency", "importance")),
+    )
+
+@st.cache_data(show_spinner=False)
+def client_row_indices(df_client_needs, client_col):
+    """Positional row indices per client, built once per upload.
+
+    groupby(...).indices yields a dict of numpy index arrays, so picking
+    one client's rows is an O(group size) iloc instead of re-scanning
+    the whole client column on every button click.
+    """
+    return df_client_needs.groupby(client_col, sort=False, observed=True).indices
+
+@st.cache_data(show_spinner=False)
+def group_client_needs_by_item_family(df_client_needs, schema, client_name):
+    """Group client needs by item family, cached per (upload, client)."""
     try:
-        client_col = find_matching_column(df_client_needs.columns, ["client", "customer", "name"])
-        item_family_col = find_matching_column(df_client_needs.columns, ["item family", "family", "item"])
-        grammage_col = find_matching_column(df_client_needs.columns, ["grammage", "weight", "gsm"])
-        laize_col = find_matching_column(df_client_needs.columns, ["laize", "width", "size"])
+        client_col = schema.client
+        item_family_col = schema.item_family
+        grammage_col = schema.grammage
+        laize_col = schema.laize
 
         if not all([client_col, item_family_col, grammage_col, laize_col]):
             st.error("Required columns not found in client needs file.")
             return None
 
-        client_needs = df_client_needs[df_client_needs[client_col] == client_name].copy()
-        if client_needs.empty:
+        rows = client_row_indices(df_client_needs, client_col).get(client_name)
+        if rows is None or len(rows) == 0:
             st.error(f"No needs found for client: {client_name}")
             return None
 
-        client_needs.loc[:, grammage_col] = pd.to_numeric(client_needs[grammage_col], errors="coerce")
-        client_needs.loc[:, laize_col] = pd.to_numeric(client_needs[laize_col], errors="coerce")
-        client_needs_cleaned = client_needs.dropna(subset=[grammage_col, laize_col])
+        # prepare_table already coerced grammage/laize and dropped bad rows,
+        # so no per-call copy or cleaning is needed.
+        client_needs = df_client_needs.iloc[rows]
 
-        grouped_needs = client_needs_cleaned.groupby(item_family_col).agg({
+        grouped_needs = client_needs.groupby(item_family_col, observed=True).agg({
             grammage_col: ['min', 'max'],
             laize_col: ['min', 'max']
         }).reset_index()
@@ -54,85 +150,278 @@ def group_client_needs_by_item_family(df_client_needs, client_name):
         st.error(f"Error grouping client needs: {e}")
         return None
 
-def filter_stocklot_for_client(df_stocklot, grouped_needs):
-    """Filter stocklot data based on grouped client needs."""
+@st.cache_data(show_spinner=False)
+def group_all_client_needs(df_client_needs, schema):
+    """Group every client's needs by item family with a single groupby.
+
+    Returns a DataFrame indexed by client carrying the same flattened
+    min/max columns as group_client_needs_by_item_family, so the Auto
+    Filter loop does N cheap index lookups instead of N full-table
+    scans and groupbys.
+    """
     try:
-        item_family_col_stocklot = find_matching_column(df_stocklot.columns, ["item family", "family", "item"])
-        grammage_col_stocklot = find_matching_column(df_stocklot.columns, ["grammage", "weight", "gsm"])
-        laize_col_stocklot = find_matching_column(df_stocklot.columns, ["laize", "width", "size"])
+        if not all([schema.client, schema.item_family, schema.grammage, schema.laize]):
+            st.error("Required columns not found in client needs file.")
+            return None
+
+        all_grouped = df_client_needs.groupby([schema.client, schema.item_family], observed=True).agg({
+            schema.grammage: ['min', 'max'],
+            schema.laize: ['min', 'max']
+        })
+        all_grouped.columns = [' '.join(col).strip() for col in all_grouped.columns.values]
+        return all_grouped.reset_index(schema.item_family)
+    except Exception as e:
+        st.error(f"Error grouping client needs: {e}")
+        return None
 
-        if not all([item_family_col_stocklot, grammage_col_stocklot, laize_col_stocklot]):
+@st.cache_data(show_spinner=False)
+def build_stocklot_index(df_stocklot, schema_stock):
+    """Sort the stocklot by (item family, grammage) and slice it per family.
+
+    With grammage sorted inside each family slice, a needs range is
+    bracketed by two np.searchsorted calls (O(log slice)) instead of a
+    full-column .between scan, leaving only the laize check over the
+    bracketed rows. Built once per upload.
+    """
+    sorted_stock = df_stocklot.sort_values(
+        [schema_stock.item_family, schema_stock.grammage], kind="mergesort"
+    ).reset_index(drop=True)
+    fam_slices = sorted_stock.groupby(schema_stock.item_family, sort=False, observed=True).indices
+    grammage_sorted = pd.to_numeric(sorted_stock[schema_stock.grammage], errors="coerce").to_numpy(dtype=float)
+    laize_values = pd.to_numeric(sorted_stock[schema_stock.laize], errors="coerce").to_numpy(dtype=float)
+    return sorted_stock, fam_slices, grammage_sorted, laize_values
+
+def _bounds_columns(columns):
+    """Map each bound key to its flattened column name in a grouped-needs
+    frame, short-circuiting on the first match instead of building lists."""
+    return {
+        key: next(col for col in columns if key in col.lower())
+        for key in ('grammage min', 'grammage max', 'laize min', 'laize max')
+    }
+
+@st.cache_data(show_spinner=False)
+def factorize_stocklot(df_stocklot, schema_stock):
+    """Integer-code the stocklot for the numba kernel, once per upload."""
+    codes, families = pd.factorize(df_stocklot[schema_stock.item_family])
+    code_of_family = {family: code for code, family in enumerate(families)}
+    grammage = pd.to_numeric(df_stocklot[schema_stock.grammage], errors="coerce").to_numpy(dtype=float)
+    laize = pd.to_numeric(df_stocklot[schema_stock.laize], errors="coerce").to_numpy(dtype=float)
+    return codes.astype(np.int64), code_of_family, grammage, laize
+
+if _HAVE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _range_filter_kernel(family_codes, grammage, laize, gmin, gmax, lmin, lmax):
+        """Mark rows whose family's needs range covers grammage and laize.
+
+        The bound arrays are indexed by family code; families without
+        needs carry NaN bounds, which fail every comparison.
+        """
+        n = family_codes.shape[0]
+        out = np.zeros(n, dtype=np.bool_)
+        for i in prange(n):
+            c = family_codes[i]
+            if c >= 0:
+                if gmin[c] <= grammage[i] and grammage[i] <= gmax[c]:
+                    if lmin[c] <= laize[i] and laize[i] <= lmax[c]:
+                        out[i] = True
+        return out
+
+def _filter_stocklot_numba(df_stocklot, grouped_needs, schema_stock, col_map):
+    """Numba path for very large stocklots: one parallel walk over the
+    contiguous code/grammage/laize arrays instead of per-family slices."""
+    codes, code_of_family, grammage, laize = factorize_stocklot(df_stocklot, schema_stock)
+
+    n_families = len(code_of_family)
+    gmin = np.full(n_families, np.nan)
+    gmax = np.full(n_families, np.nan)
+    lmin = np.full(n_families, np.nan)
+    lmax = np.full(n_families, np.nan)
+    for item_family, g0, g1, l0, l1 in zip(
+        grouped_needs[grouped_needs.columns[0]],
+        grouped_needs[col_map['grammage min']],
+        grouped_needs[col_map['grammage max']],
+        grouped_needs[col_map['laize min']],
+        grouped_needs[col_map['laize max']],
+    ):
+        code = code_of_family.get(item_family)
+        if code is not None:
+            gmin[code], gmax[code], lmin[code], lmax[code] = g0, g1, l0, l1
+
+    mask = _range_filter_kernel(codes, grammage, laize, gmin, gmax, lmin, lmax)
+    return df_stocklot[mask].reset_index(drop=True)
+
+def filter_stocklot_for_client(df_stocklot, grouped_needs, schema_stock):
+    """Filter stocklot data based on grouped client needs."""
+    try:
+        if not all([schema_stock.item_family, schema_stock.grammage, schema_stock.laize]):
             st.error("Required columns not found in stocklot file.")
             return None
 
-        filtered_results = []
-        for _, row in grouped_needs.iterrows():
-            grammage_min_col = [col for col in grouped_needs.columns if 'grammage min' in col.lower()][0]
-            grammage_max_col = [col for col in grouped_needs.columns if 'grammage max' in col.lower()][0]
-            laize_min_col = [col for col in grouped_needs.columns if 'laize min' in col.lower()][0]
-            laize_max_col = [col for col in grouped_needs.columns if 'laize max' in col.lower()][0]
-
-            item_family = row[grouped_needs.columns[0]]
-            min_grammage = row[grammage_min_col]
-            max_grammage = row[grammage_max_col]
-            min_laize = row[laize_min_col]
-            max_laize = row[laize_max_col]
-
-            df_filtered = df_stocklot[
-                (df_stocklot[item_family_col_stocklot] == item_family) &
-                (df_stocklot[grammage_col_stocklot].between(min_grammage, max_grammage)) &
-                (df_stocklot[laize_col_stocklot].between(min_laize, max_laize))
-            ]
-            filtered_results.append(df_filtered)
-
-        return pd.concat(filtered_results, ignore_index=True) if filtered_results else None
+        if grouped_needs.empty:
+            return None
+
+        col_map = _bounds_columns(grouped_needs.columns)
+
+        if _HAVE_NUMBA and len(df_stocklot) >= _NUMBA_MIN_ROWS:
+            return _filter_stocklot_numba(df_stocklot, grouped_needs, schema_stock, col_map)
+
+        sorted_stock, fam_slices, grammage_sorted, laize_values = build_stocklot_index(
+            df_stocklot, schema_stock
+        )
+
+        hits = []
+        for item_family, gmin, gmax, lmin, lmax in zip(
+            grouped_needs[grouped_needs.columns[0]],
+            grouped_needs[col_map['grammage min']],
+            grouped_needs[col_map['grammage max']],
+            grouped_needs[col_map['laize min']],
+            grouped_needs[col_map['laize max']],
+        ):
+            rows = fam_slices.get(item_family)
+            if rows is None:
+                continue
+            start, stop = rows[0], rows[-1] + 1
+            lo = start + np.searchsorted(grammage_sorted[start:stop], gmin, side="left")
+            hi = start + np.searchsorted(grammage_sorted[start:stop], gmax, side="right")
+            if lo >= hi:
+                continue
+            in_laize = (laize_values[lo:hi] >= lmin) & (laize_values[lo:hi] <= lmax)
+            if in_laize.any():
+                hits.append(sorted_stock.iloc[lo:hi][in_laize])
+
+        if not hits:
+            return sorted_stock.iloc[:0].reset_index(drop=True)
+        return pd.concat(hits, ignore_index=True)
     except Exception as e:
         st.error(f"Error filtering stocklot: {e}")
         return None
 
-def classify_needs_by_priority(df):
-    """Classify client needs by priority."""
+@st.cache_data(show_spinner=False)
+def filter_all_clients(df_stocklot, all_grouped, schema_stock):
+    """Filter the stocklot for every client with one merge.
+
+    Instead of looping over clients in Python and filtering per client,
+    merge the stocklot against the full client-indexed bounds table,
+    apply one range mask, and split the matches by client. Returns a
+    dict mapping client name to its filtered stocklot.
+    """
     try:
-        priority_col = find_matching_column(df.columns, ["priority", "urgency", "importance"])
+        if all_grouped is None or all_grouped.empty:
+            return {}
+        if not all([schema_stock.item_family, schema_stock.grammage, schema_stock.laize]):
+            st.error("Required columns not found in stocklot file.")
+            return {}
+
+        needs = all_grouped.reset_index()
+        col_map = _bounds_columns(needs.columns)
+
+        # Reduce the needs side to the key and bound columns under internal
+        # names: a shared column name (e.g. both tables carrying "Client")
+        # would otherwise get _x/_y suffixes in the merge and break the
+        # lookups below.
+        needs = pd.DataFrame({
+            "_need_client": needs[needs.columns[0]],
+            "_need_family": needs[needs.columns[1]],
+            "_need_gmin": needs[col_map['grammage min']],
+            "_need_gmax": needs[col_map['grammage max']],
+            "_need_lmin": needs[col_map['laize min']],
+            "_need_lmax": needs[col_map['laize max']],
+        })
+
+        merged = df_stocklot.merge(
+            needs,
+            left_on=schema_stock.item_family,
+            right_on="_need_family",
+            how="inner",
+        )
+        mask = (
+            merged[schema_stock.grammage].between(merged["_need_gmin"], merged["_need_gmax"]) &
+            merged[schema_stock.laize].between(merged["_need_lmin"], merged["_need_lmax"])
+        )
+        matches = merged.loc[mask]
+        return {
+            client: group.loc[:, df_stocklot.columns].reset_index(drop=True)
+            for client, group in matches.groupby("_need_client", sort=False, observed=True)
+        }
+    except Exception as e:
+        st.error(f"Error filtering stocklot: {e}")
+        return {}
+
+def _to_xlsx_bytes(df):
+    """Serialize one filtered frame to xlsx bytes in memory; runs on a
+    worker thread during bulk export."""
+    buffer = BytesIO()
+    df.to_excel(buffer, index=False, engine="xlsxwriter")
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False)
+def classify_needs_by_priority(df, schema):
+    """Classify client needs by priority, cached per upload."""
+    try:
+        priority_col = schema.priority
         if not priority_col:
             st.error("Priority column not found in client needs file.")
             return None
 
-        urgent_needs = df[df[priority_col].str.lower().str.contains("urgent")]
-        less_urgent_needs = df[df[priority_col].str.lower().str.contains("less urgent")]
-        last_priority_needs = df[df[priority_col].str.lower().str.contains("last priority")]
-        general_needs = df[~df[priority_col].str.lower().str.contains("urgent|less urgent|last priority")]
-
+        # The lowercased priority labels were prepared once at upload;
+        # bucket them branchlessly with np.select, checking the longer
+        # keywords first so "less urgent" never lands in Urgent.
+        lowered = df["_prio_lc"] if "_prio_lc" in df.columns else df[priority_col].astype(str).str.lower()
+        conds = [
+            lowered.str.contains("last priority", regex=False),
+            lowered.str.contains("less urgent", regex=False),
+            lowered.str.contains("urgent", regex=False),
+        ]
+        codes = np.select(conds, [2, 1, 0], default=3).astype(np.int8)
         return {
-            "Urgent": urgent_needs,
-            "Less Urgent": less_urgent_needs,
-            "Last Priority": last_priority_needs,
-            "General": general_needs,
+            "Urgent": df[codes == 0],
+            "Less Urgent": df[codes == 1],
+            "Last Priority": df[codes == 2],
+            "General": df[codes == 3],
         }
     except Exception as e:
         st.error(f"Error classifying needs by priority: {e}")
         return None
 
 # Streamlit app
-def main():
-    global df_stocklot, df_client_needs
+def _load_upload(uploaded_file, key):
+    """Parse an upload into session state, only when its file id changes.
+
+    Streamlit reruns the whole script on every widget interaction;
+    keeping the parsed table and its schema in st.session_state means a
+    keystroke in a text input never re-triggers parsing or preparation.
+    """
+    if st.session_state.get(f"{key}_file_id") != uploaded_file.file_id:
+        df = read_table(uploaded_file.name, uploaded_file.getvalue())
+        schema = build_schema(df.columns)
+        st.session_state[f"df_{key}"] = prepare_table(df, schema, cache_priority=key == "client_needs")
+        st.session_state[f"schema_{key}"] = schema
+        st.session_state[f"{key}_file_id"] = uploaded_file.file_id
+        # Results built from the previous upload are stale now.
+        st.session_state.pop("selections", None)
 
+def main():
     st.title("ROXAF - Client Stocklot Matching")
 
     # File Upload Section
     st.header("Upload Files")
     col1, col2 = st.columns(2)  # Split into 2 columns
     with col1:
-        stocklot_file = st.file_uploader("Upload Stocklot File", type=["xlsx"])
+        stocklot_file = st.file_uploader("Upload Stocklot File", type=["xlsx", "parquet", "feather"])
         if stocklot_file:
-            df_stocklot = pd.read_excel(stocklot_file)
+            _load_upload(stocklot_file, "stocklot")
             st.success("Stocklot file uploaded successfully!")
     with col2:
-        client_needs_file = st.file_uploader("Upload Client Needs File", type=["xlsx"])
+        client_needs_file = st.file_uploader("Upload Client Needs File", type=["xlsx", "parquet", "feather"])
         if client_needs_file:
-            df_client_needs = pd.read_excel(client_needs_file)
+            _load_upload(client_needs_file, "client_needs")
             st.success("Client needs file uploaded successfully!")
 
+    df_stocklot = st.session_state.get("df_stocklot")
+    schema_stocklot = st.session_state.get("schema_stocklot")
+    df_client_needs = st.session_state.get("df_client_needs")
+    schema_needs = st.session_state.get("schema_client_needs")
+
     # Filtering Section
     st.header("Filtering Options")
 
@@ -147,24 +436,35 @@ def main():
             st.error("Please enter a client name.")
         else:
             start_time = time.time()  # Start timing
-            grouped_needs = group_client_needs_by_item_family(df_client_needs, client_name)
+            grouped_needs = group_client_needs_by_item_family(df_client_needs, schema_needs, client_name)
             if grouped_needs is None:
                 st.error(f"No needs found for {client_name}.")
             else:
-                df_filtered = filter_stocklot_for_client(df_stocklot, grouped_needs)
+                df_filtered = filter_stocklot_for_client(df_stocklot, grouped_needs, schema_stocklot)
                 if df_filtered is None or df_filtered.empty:
                     st.error(f"No matching stocklots found for {client_name}.")
                 else:
-                    # Save filtered data to a temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_file:
-                        df_filtered.to_excel(tmp_file.name, index=False)
-                        st.success(f"Filtered data for {client_name} ready for download.")
+                    st.success(f"Filtered data for {client_name} ready for download.")
+                    st.download_button(
+                        label="Download File",
+                        data=_to_xlsx_bytes(df_filtered),
+                        file_name=f"{client_name}-ROXAF-Manual.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+                    # Mixed-type object columns (e.g. Price holding 400 and
+                    # '400/500') can't be written to Parquet; fall back to
+                    # offering only the xlsx download in that case.
+                    try:
+                        parquet_buffer = BytesIO()
+                        df_filtered.to_parquet(parquet_buffer, engine="pyarrow", compression="zstd")
                         st.download_button(
-                            label="Download File",
-                            data=open(tmp_file.name, "rb").read(),
-                            file_name=f"{client_name}-ROXAF-Manual.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                            label="Download as Parquet",
+                            data=parquet_buffer.getvalue(),
+                            file_name=f"{client_name}-ROXAF-Manual.parquet",
+                            mime="application/octet-stream"
                         )
+                    except Exception as e:
+                        st.error(f"Error writing Parquet file: {e}")
             end_time = time.time()  # End timing
             st.write(f"Operation duration: **{(end_time - start_time) * 1000:.2f} ms**")
 
@@ -176,39 +476,40 @@ def main():
             st.error("Please upload both files first.")
         else:
             start_time = time.time()  # Start timing
-            classified_needs = classify_needs_by_priority(df_client_needs)
+            classified_needs = classify_needs_by_priority(df_client_needs, schema_needs)
+            client_col = schema_needs.client
             if not classified_needs:
                 st.error("Error: Priority column not found in client needs file.")
+            elif not client_col:
+                st.error("Error: Client column not found in client needs file.")
             else:
-                files_to_download = []
+                all_grouped = group_all_client_needs(df_client_needs, schema_needs)
+                filtered_by_client = filter_all_clients(df_stocklot, all_grouped, schema_stocklot)
+                export_tasks = []
                 for priority, needs_df in classified_needs.items():
-                    client_col = find_matching_column(df_client_needs.columns, ["client", "customer", "name"])
-                    if not client_col:
-                        st.error("Error: Client column not found in client needs file.")
-                        break
-
                     client_names = needs_df[client_col].unique()
                     for client_name in client_names:
-                        grouped_needs = group_client_needs_by_item_family(df_client_needs, client_name)
-                        if grouped_needs is None:
-                            continue
-
-                        df_filtered = filter_stocklot_for_client(df_stocklot, grouped_needs)
+                        df_filtered = filtered_by_client.get(client_name)
                         if df_filtered is None or df_filtered.empty:
                             continue
 
-                        # Save filtered data to a temporary file
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_file:
-                            df_filtered.to_excel(tmp_file.name, index=False)
-                            files_to_download.append((tmp_file.name, f"{client_name}-ROXAF-{priority}.xlsx"))
-                            st.success(f"Filtered data for {client_name} ({priority}) ready for download.")
+                        export_tasks.append((f"{client_name}-ROXAF-{priority}.xlsx", df_filtered))
+                        st.success(f"Filtered data for {client_name} ({priority}) ready for download.")
+
+                # Serialize all workbooks in parallel; the writers spend most
+                # of their time in zip/IO, which overlaps well across threads.
+                files_to_download = []
+                if export_tasks:
+                    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+                        payloads = list(executor.map(lambda task: _to_xlsx_bytes(task[1]), export_tasks))
+                    files_to_download = [(name, data) for (name, _), data in zip(export_tasks, payloads)]
 
                 # Bulk Download Option
                 if files_to_download:
                     zip_buffer = BytesIO()
-                    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-                        for file_path, file_name in files_to_download:
-                            zip_file.write(file_path, file_name)
+                    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
+                        for file_name, data in files_to_download:
+                            zip_file.writestr(file_name, data)
                     zip_buffer.seek(0)
                     st.download_button(
                         label="Download All Files as ZIP",
@@ -229,54 +530,44 @@ def main():
             st.error("Please upload both files first.")
         else:
             start_time = time.time()  # Start timing
-            classified_needs = classify_needs_by_priority(df_client_needs)
+            classified_needs = classify_needs_by_priority(df_client_needs, schema_needs)
+            client_col = schema_needs.client
             if not classified_needs:
                 st.error("Error: Priority column not found in client needs file.")
+            elif not client_col:
+                st.error("Error: Client column not found in client needs file.")
             else:
-                client_col = find_matching_column(df_client_needs.columns, ["client", "customer", "name"])
-                if not client_col:
-                    st.error("Error: Client column not found in client needs file.")
-                else:
-                    # Display client names with matching stocklots
-                    st.write("### Clients with Matching Stocklots")
-                    col1, col2 = st.columns(2)  # Split into 2 columns
-                    for priority, needs_df in classified_needs.items():
-                        client_names = needs_df[client_col].unique()
-                        for idx, client_name in enumerate(client_names):
-                            grouped_needs = group_client_needs_by_item_family(df_client_needs, client_name)
-                            if grouped_needs is None:
-                                continue
-
-                            df_filtered = filter_stocklot_for_client(df_stocklot, grouped_needs)
-                            if df_filtered is None or df_filtered.empty:
-                                continue
-
-                            # Show client name and download button
-                            if idx % 2 == 0:
-                                with col1:
-                                    st.write(f"**{client_name}** ({priority})")
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_file:
-                                        df_filtered.to_excel(tmp_file.name, index=False)
-                                        st.download_button(
-                                            label=f"Download {client_name}",
-                                            data=open(tmp_file.name, "rb").read(),
-                                            file_name=f"{client_name}-ROXAF-{priority}.xlsx",
-                                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                        )
-                            else:
-                                with col2:
-                                    st.write(f"**{client_name}** ({priority})")
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_file:
-                                        df_filtered.to_excel(tmp_file.name, index=False)
-                                        st.download_button(
-                                            label=f"Download {client_name}",
-                                            data=open(tmp_file.name, "rb").read(),
-                                            file_name=f"{client_name}-ROXAF-{priority}.xlsx",
-                                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                        )
+                all_grouped = group_all_client_needs(df_client_needs, schema_needs)
+                filtered_by_client = filter_all_clients(df_stocklot, all_grouped, schema_stocklot)
+                selections = []
+                for priority, needs_df in classified_needs.items():
+                    for client_name in needs_df[client_col].unique():
+                        df_filtered = filtered_by_client.get(client_name)
+                        if df_filtered is None or df_filtered.empty:
+                            continue
+                        selections.append((str(client_name), priority, _to_xlsx_bytes(df_filtered)))
+                st.session_state["selections"] = selections
             end_time = time.time()  # End timing
             st.write(f"Operation duration: **{(end_time - start_time) * 1000:.2f} ms**")
 
+    # The selections are built only on the button click above; rendering
+    # them from session state keeps the download buttons alive across
+    # reruns (clicking one no longer wipes the rest) without recomputing.
+    selections = st.session_state.get("selections")
+    if selections:
+        st.write("### Clients with Matching Stocklots")
+        col1, col2 = st.columns(2)  # Split into 2 columns
+        for idx, (client_name, priority, payload) in enumerate(selections):
+            with col1 if idx % 2 == 0 else col2:
+                st.write(f"**{client_name}** ({priority})")
+                st.download_button(
+                    label=f"Download {client_name}",
+                    data=payload,
+                    file_name=f"{client_name}-ROXAF-{priority}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key=f"check_dl_{idx}"
+                )
+
 # Run the app
 if __name__ == "__main__":
     main()
\ No newline at end of file